@@ -0,0 +1,99 @@
+# Checks that volume_matching_hierarchical labels synthetic trades exactly like the
+# reference implementation volume_matching_parallel_better.
+# Needs the compiled detect_wash_trades.dll in the working directory.
+
+import sys
+import numpy as np
+import pandas as pd
+
+from volume_matching_algorithm import volume_matching_parallel_better, volume_matching_hierarchical
+
+def margin_edge_amounts(rng, n: int = 6):
+    """n cent amounts and directions between two traders whose final balance is exactly mean / 100"""
+    while True:
+        cents = rng.integers(10_000, 100_000, n - 1)
+        signs = rng.choice([-1, 1], n - 1)
+        # the last trade x credits the first trader: 100 * n * (signed + x) == total + x
+        remainder = cents.sum() - 100 * n * (signs * cents).sum()
+        if remainder > 0 and remainder % (100 * n - 1) == 0:
+            cents = np.append(cents, remainder // (100 * n - 1))
+            return cents / 100, np.append(signs, 1)
+
+def synthetic_trades(seed: int, n: int = 2000, num_traders: int = 6, num_tokens: int = 3, days: int = 30, num_edge_hours: int = 40):
+    rng = np.random.default_rng(seed)
+    start = 1_500_000_000 - 1_500_000_000 % 86400
+    stop = start + int(rng.integers(days // 2 * 86400, days * 86400))
+
+    timestamps = np.sort(rng.integers(start, stop, n))
+    buyers = rng.integers(1, num_traders + 1, n)
+    sellers = rng.integers(1, num_traders + 1, n)
+    sellers = np.where(sellers == buyers, sellers % num_traders + 1, sellers)
+    amounts = rng.choice([1.0, 2.0, 5.0], n) if seed % 2 else rng.random(n) * 10
+    tokens = rng.choice([f"token{i}" for i in range(num_tokens)], n)
+
+    # wash trades: a trade reversed at the same timestamp
+    for i in range(0, n - 1, 2):
+        if rng.random() < 0.7:
+            buyers[i + 1], sellers[i + 1], amounts[i + 1] = sellers[i], buyers[i], amounts[i]
+            timestamps[i + 1], tokens[i + 1] = timestamps[i], tokens[i]
+
+    # hours that sit exactly at the margin, where only the kernel's own float sums decide
+    edge_hours = rng.choice(np.arange(start // 3600, stop // 3600 - 1), num_edge_hours, replace=False)
+    for i, hour in enumerate(edge_hours):
+        rows = slice(i * 6, i * 6 + 6)
+        edge_amounts, signs = margin_edge_amounts(rng)
+        first, second = rng.choice(np.arange(1, num_traders + 1), 2, replace=False)
+        timestamps[rows] = np.sort(rng.integers(hour * 3600, hour * 3600 + 3600, 6))
+        sellers[rows] = np.where(signs > 0, first, second)
+        buyers[rows] = np.where(signs > 0, second, first)
+        amounts[rows] = edge_amounts
+        tokens[rows] = "edge"
+
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, buyers, sellers, amounts, tokens = timestamps[order], buyers[order], sellers[order], amounts[order], tokens[order]
+
+    # a balanced pair at the last timestamp, which pd.cut drops from the last window
+    timestamps[-2:] = stop
+    buyers[-1], sellers[-1], amounts[-1], tokens[-1] = sellers[-2], buyers[-2], amounts[-2], tokens[-2]
+
+    trades = pd.DataFrame({
+        "timestamp": timestamps,
+        "eth_buyer_id": buyers.astype(str),
+        "eth_seller_id": sellers.astype(str),
+        "token": tokens,
+        "trade_amount_token": amounts,
+    })
+    trades["eth_buyer"] = "0x" + trades["eth_buyer_id"]
+    trades["eth_seller"] = "0x" + trades["eth_seller_id"]
+    trades["cut"] = (trades["timestamp"] // 86400 * 86400).astype(float)
+    trades["date"] = pd.to_datetime(trades["cut"], unit="s")
+    trades["trade_amount_dollar"] = trades["trade_amount_token"]
+    trades["transactionHash"] = [f"0x{i:064x}" for i in range(n)]
+    return trades
+
+if __name__ == "__main__":
+    num_datasets = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    global_scc_traders_map = {
+        "all": [str(i) for i in range(1, 7)],
+        "first": ["1", "2", "3"],
+        "last": ["4", "5"],
+    }
+    relevant = pd.DataFrame({"scc_hash": ["first", "all", "last"]})
+
+    mismatches = 0
+    for seed in range(num_datasets):
+        trades = synthetic_trades(seed)
+        expected, expected_wash_trades = volume_matching_parallel_better(trades.copy(), relevant, global_scc_traders_map)
+        actual, actual_wash_trades = volume_matching_hierarchical(trades.copy(), relevant, global_scc_traders_map)
+
+        same = (expected["wash_label"] == actual["wash_label"]).all() and all(
+            sorted(expected_wash_trades[scc_id][window_size]) == sorted(actual_wash_trades[scc_id][window_size])
+            for scc_id in expected_wash_trades
+            for window_size in expected_wash_trades[scc_id]
+        )
+        print(f"dataset {seed}: {'ok' if same else 'MISMATCH'} ({expected['wash_label'].sum()} wash trades)")
+        mismatches += not same
+
+    print(f"{mismatches} of {num_datasets} datasets differ")
+    sys.exit(mismatches > 0)
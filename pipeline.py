@@ -4,7 +4,7 @@ import time
 
 from preprocessing import preprocessing
 from scc_algorithm import scc_algo_parallel
-from volume_matching_algorithm import volume_matching_parallel_better, get_address_clusters, volume_matching_parallel_overlapping
+from volume_matching_algorithm import volume_matching_hierarchical, get_address_clusters, volume_matching_parallel_overlapping
 
 start = time.time()
 
@@ -33,7 +33,7 @@ print("Relevant SCCs:", len(relevant))
 
 print("Volume Matching algorithm")
 start_vol = time.time()
-trades, wash_trades_dict = volume_matching_parallel_better(trades, relevant, global_scc_traders_map)
+trades, wash_trades_dict = volume_matching_hierarchical(trades, relevant, global_scc_traders_map)
 end_vol = time.time()
 print(f"Volume Matching Time: {(end_vol - start_vol)/60:.4f} minutes")
 
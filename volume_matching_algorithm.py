@@ -263,4 +263,219 @@ def volume_matching_parallel_better(trades: pd.DataFrame, relevant: pd.DataFrame
 
                 pbar.update(1)
     
-    return trades, wash_trades
\ No newline at end of file
+    return trades, wash_trades
+
+def coarse_window(windows, ratio: int):
+    """Maps window indices of one grid onto a grid `ratio` times coarser"""
+    return np.asarray(windows) // ratio
+
+def build_bucket_aggregates(temp_trades: pd.DataFrame, column: str):
+    """Per (token, window) trade counts and volume sums, and per (token, window, trader) net balance deltas"""
+    amounts = temp_trades["trade_amount_token"].astype(np.float64)
+    keyed = pd.DataFrame({"token": temp_trades["token"], "window": temp_trades[column], "delta": amounts})
+
+    stats = keyed.groupby(["token", "window"]).agg(count=("delta", "size"), volume=("delta", "sum"))
+
+    # same sign convention as the kernel: eth_seller is credited, eth_buyer is debited
+    legs = pd.concat([
+        keyed.assign(trader=temp_trades["eth_seller"]),
+        keyed.assign(trader=temp_trades["eth_buyer"], delta=-amounts),
+    ])
+    deltas = legs.groupby(["token", "window", "trader"])["delta"].sum()
+
+    return stats, deltas
+
+def roll_up_aggregates(stats: pd.DataFrame, deltas: pd.Series, ratio: int):
+    """Sums the aggregates of a finer window grid into the windows `ratio` times larger"""
+    coarse_stats = stats.reset_index()
+    coarse_stats["window"] = coarse_window(coarse_stats["window"], ratio)
+    coarse_stats = coarse_stats.groupby(["token", "window"])[["count", "volume"]].sum()
+
+    coarse_deltas = deltas.reset_index()
+    coarse_deltas["window"] = coarse_window(coarse_deltas["window"], ratio)
+    coarse_deltas = coarse_deltas.groupby(["token", "window", "trader"])["delta"].sum()
+
+    return coarse_stats, coarse_deltas
+
+def combine_aggregates(stats: pd.DataFrame, deltas: pd.Series, other_stats: pd.DataFrame, other_deltas: pd.Series):
+    """Sums two sets of aggregates over the same window grid"""
+    stats = pd.concat([stats, other_stats]).groupby(level=["token", "window"]).sum()
+    deltas = pd.concat([deltas, other_deltas]).groupby(level=["token", "window", "trader"]).sum()
+    return stats, deltas
+
+def plan_windows(temp_trades: pd.DataFrame, column: str, stats: pd.DataFrame, deltas: pd.Series, child=None, margin: float = 0.01):
+    """Decides which (token, window) groups of one window size still need the kernel.
+
+    The aggregates decide a window without running the kernel when:
+    - it has fewer than two trades or zero volume: the kernel never flags anything
+    - it has exactly the trades of one finer window, in the same order: reuse its result
+    - the whole window is within margin: everything but the last trade is flagged
+    The last check is only trusted when it holds with room to spare for the rounding
+    of the sums, which pandas and the kernel add up in different orders.
+
+    child is None for the finest window size, otherwise a tuple (child_stats, ratio).
+    Returns (results, reused, pending): the hashes of the decided windows, the
+    windows mapped to the finer window whose result they reuse, and the remaining
+    windows as an index.
+    """
+    results = {}
+    reused = {}
+
+    skip = ((stats["count"] < 2) | (stats["volume"] == 0)).to_numpy()
+    resolved = skip.copy()
+    results.update({key: [] for key in stats.index[skip]})
+
+    if child is not None:
+        child_stats, ratio = child
+        children = child_stats.reset_index().rename(columns={"window": "child"})
+        children["window"] = coarse_window(children["child"], ratio)
+        per_window = children.groupby(["token", "window"]).agg(
+            num_children=("child", "size"),
+            child=("child", "first"),
+            child_count=("count", "sum"),
+        )
+        per_window = per_window.reindex(stats.index)
+        reusable = (per_window["num_children"] == 1).to_numpy() & (per_window["child_count"] == stats["count"]).to_numpy() & ~resolved
+        reused = dict(zip(
+            stats.index[reusable],
+            zip(stats.index.get_level_values("token")[reusable], per_window["child"].to_numpy()[reusable].astype(np.int64)),
+        ))
+        resolved |= reusable
+
+    # float64 sums of `count` terms are off by at most count * eps * volume, in pandas and in the kernel alike
+    means = stats["volume"] / stats["count"]
+    slack = 4 * np.finfo(np.float64).eps * stats["count"]
+    imbalance = deltas.abs().groupby(level=["token", "window"]).max().reindex(stats.index, fill_value=0.0)
+    balanced = (imbalance + slack * stats["volume"] <= margin * means * (1 - slack)).to_numpy() & ~resolved
+
+    keys = pd.MultiIndex.from_frame(temp_trades[["token", column]], names=["token", "window"])
+    if balanced.any():
+        rows = temp_trades[keys.isin(stats.index[balanced])]
+        not_last = rows.groupby(["token", column]).cumcount(ascending=False) > 0
+        results.update(rows[not_last].groupby(["token", column])["transactionHash"].agg(list).to_dict())
+        resolved |= balanced
+
+    return results, reused, stats.index[~resolved]
+
+def volume_matching_hierarchical(trades: pd.DataFrame, relevant: pd.DataFrame, global_scc_traders_map, window_sizes_in_seconds=(3600, 86400, 604800), margin: float = 0.01):
+    """Same labels as volume_matching_parallel_better, but the trades of an SCC are
+    aggregated once per (token, finest window) and rolled up to the coarser window
+    sizes, which lets most windows skip the kernel. The windows of all sizes that
+    still need it go to the kernel in one parallel pass per SCC.
+
+    Every window size must be a multiple of the finest one.
+    """
+
+    window_sizes_in_seconds = sorted(set(window_sizes_in_seconds))
+    finest = window_sizes_in_seconds[0]
+    if any(size % finest for size in window_sizes_in_seconds):
+        raise ValueError(f"window sizes must be multiples of the finest window size ({finest}s)")
+
+    trades["wash_label"] = False
+
+    window_start = trades["cut"].min()
+    window_end = trades["timestamp"].max()
+    relevant_scc = relevant["scc_hash"].to_list()
+    wash_trades = defaultdict(lambda: defaultdict(list))
+
+    # same window grids as seqlast/pd.cut in volume_matching_parallel_better:
+    # pd.cut(right=False) drops the trades at or after the last break
+    last_breaks = {
+        size: seqlast(window_start, window_end, size)[-1]
+        for size in window_sizes_in_seconds
+    }
+    # every coarser window is rolled up from the largest finer window size that tiles it
+    parent_sizes = {
+        size: max(p for p in window_sizes_in_seconds if p < size and size % p == 0)
+        for size in window_sizes_in_seconds[1:]
+    }
+
+    with tqdm(total=len(window_sizes_in_seconds) * len(relevant), desc="Processing SCCs") as pbar, Parallel(n_jobs=16) as parallel:
+        for scc_id in relevant_scc:
+            scc_traders = global_scc_traders_map[scc_id]
+
+            scc_trades = trades[
+                (trades["eth_buyer_id"].isin(scc_traders)) &
+                (trades["eth_seller_id"].isin(scc_traders)) &
+                (trades["wash_label"] == False)
+            ].sort_values("cut")
+
+            if scc_trades.empty:
+                for window_size in window_sizes_in_seconds:
+                    wash_trades[scc_id][str(window_size)] = []
+                pbar.update(len(window_sizes_in_seconds))
+                continue
+
+            temp_trades = scc_trades[[
+                "transactionHash", "token", "date", "timestamp", 
+                "eth_seller", "eth_buyer", "trade_amount_token", "trade_amount_dollar", "wash_label"
+            ]].reset_index(drop=True)
+
+            # Window indices (right-exclusive, left-inclusive), -1 for trades past the last break
+            timestamps = temp_trades["timestamp"].to_numpy(dtype=np.float64)
+            for window_size in window_sizes_in_seconds:
+                temp_trades[f"window_{window_size}"] = np.where(
+                    timestamps < last_breaks[window_size],
+                    np.floor((timestamps - window_start) / window_size),
+                    -1,
+                ).astype(np.int64)
+
+            # Trades inside every grid are rolled up, the few at the end that
+            # only some grids keep are added per window size
+            in_all_grids = timestamps < min(last_breaks.values())
+
+            levels = {}
+            jobs = []
+            job_keys = []
+            for window_size in window_sizes_in_seconds:
+                column = f"window_{window_size}"
+
+                if window_size == finest:
+                    core_stats, core_deltas = build_bucket_aggregates(temp_trades[in_all_grids], column)
+                    child = None
+                else:
+                    parent_size = parent_sizes[window_size]
+                    parent_core_stats, parent_core_deltas, parent_stats = levels[parent_size][:3]
+
+                    core_stats, core_deltas = roll_up_aggregates(parent_core_stats, parent_core_deltas, window_size // parent_size)
+                    child = (parent_stats, window_size // parent_size)
+
+                stats, deltas = core_stats, core_deltas
+                at_end = ~in_all_grids & (temp_trades[column] >= 0).to_numpy()
+                if at_end.any():
+                    stats, deltas = combine_aggregates(stats, deltas, *build_bucket_aggregates(temp_trades[at_end], column))
+
+                results, reused, pending = plan_windows(temp_trades, column, stats, deltas, child, margin)
+                levels[window_size] = (core_stats, core_deltas, stats, results, reused)
+
+                keys = pd.MultiIndex.from_frame(temp_trades[["token", column]], names=["token", "window"])
+                pending_trades = temp_trades.loc[
+                    keys.isin(pending),
+                    ["token", column, "transactionHash", "eth_seller", "eth_buyer", "trade_amount_token"]
+                ]
+                for key, group in pending_trades.groupby(["token", column], sort=False):
+                    jobs.append(delayed(detect_label_wash_trades)(group.reset_index(drop=True), margin))
+                    job_keys.append((window_size, key))
+
+            for (window_size, key), hashes in zip(job_keys, parallel(jobs)):
+                levels[window_size][3][key] = hashes
+
+            scc_hashes = set()
+            for window_size in window_sizes_in_seconds:
+                results, reused = levels[window_size][3:]
+                if reused:
+                    parent_results = levels[parent_sizes[window_size]][3]
+                    for key, child_key in reused.items():
+                        results[key] = parent_results[child_key]
+
+                all_hashes = [tx for hashes in results.values() for tx in hashes]
+
+                # Store
+                wash_trades[scc_id][str(window_size)] = all_hashes # all transaction hashes that are wash_trades
+                scc_hashes.update(all_hashes)
+
+                pbar.update(1)
+
+            trades.loc[trades['transactionHash'].isin(scc_hashes), 'wash_label'] = True
+
+    return trades, wash_trades